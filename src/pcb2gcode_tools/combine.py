@@ -19,21 +19,17 @@ Safety features:
 """
 
 import argparse
+import multiprocessing
 import os
 import sys
 
 from .gcode_utils import (
     # Parsing
     parse_gcode_file,
-    Line,
-    GCodeSpindleSpeed,
     # Validation
     validate_files_for_combining,
     get_safe_z_from_files,
     get_tool_change_z_from_files,
-    # Helpers
-    get_z_from_line,
-    is_rapid_move,
     # Constants
     DEFAULT_TOOL_CHANGE_Z,
     DEFAULT_SPINDLE_DWELL,
@@ -50,6 +46,10 @@ from .gcode_utils import (
     strip_leading_dwells,
 )
 
+# Parse inputs in worker processes only when at least two are this large;
+# for smaller files process startup and pickling cost more than they save
+PARALLEL_PARSE_MIN_BYTES = 2 * 1024 * 1024
+
 
 def generate_tool_change_sequence(tool_number, tool_size, tool_type, spindle_speed,
                                    tool_change_z=DEFAULT_TOOL_CHANGE_Z,
@@ -93,6 +93,21 @@ def generate_tool_change_sequence(tool_number, tool_size, tool_type, spindle_spe
     return lines
 
 
+def parse_input_files(input_files):
+    """
+    Parse input files, in parallel when several of them are large.
+
+    Returns list of parsed file dicts, in input order.
+    """
+    cpus = os.cpu_count() or 1
+    large_files = [f for f in input_files if os.path.getsize(f) >= PARALLEL_PARSE_MIN_BYTES]
+    if len(large_files) < 2 or cpus < 2:
+        return [parse_gcode_file(f) for f in input_files]
+
+    with multiprocessing.Pool(min(len(input_files), cpus)) as pool:
+        return pool.map(parse_gcode_file, input_files)
+
+
 def combine_files(input_files, output_file, multi_tool=False):
     """
     Combine multiple G-code files into one.
@@ -108,16 +123,24 @@ def combine_files(input_files, output_file, multi_tool=False):
         print("Error: Need at least 2 files to combine.", file=sys.stderr)
         return False
 
-    # Parse all files
-    parsed_files = []
     for filepath in input_files:
         if not os.path.exists(filepath):
             print(f"Error: File not found: {filepath}", file=sys.stderr)
             return False
-        parsed = parse_gcode_file(filepath)
-        parsed_files.append(parsed)
+
+    # Parse all files, collecting spindle speeds and tool sizes as we go
+    parsed_files = parse_input_files(input_files)
+    spindle_speeds = []
+    unique_speeds = set()
+    known_tool_size = None
+    for parsed in parsed_files:
+        spindle_speeds.append((parsed['basename'], parsed['spindle_speed']))
+        if parsed['spindle_speed'] is not None:
+            unique_speeds.add(parsed['spindle_speed'])
+        if known_tool_size is None:
+            known_tool_size = parsed['tool_size']
         tool_str = f"{parsed['tool_size']}mm" if parsed['tool_size'] else "unknown"
-        print(f"Parsed {os.path.basename(filepath)}: "
+        print(f"Parsed {parsed['basename']}: "
               f"{len(parsed['operations'])} ops, "
               f"S{parsed['spindle_speed']}, F{parsed['feedrate']}, "
               f"tool={tool_str}" +
@@ -151,8 +174,6 @@ def combine_files(input_files, output_file, multi_tool=False):
 
     # Report spindle speed differences in multi-tool mode
     if multi_tool:
-        spindle_speeds = [(os.path.basename(p['filepath']), p['spindle_speed']) for p in parsed_files]
-        unique_speeds = set(s for _, s in spindle_speeds if s is not None)
         if len(unique_speeds) > 1:
             print(f"\nNote: Files have different spindle speeds:")
             for name, speed in spindle_speeds:
@@ -160,109 +181,113 @@ def combine_files(input_files, output_file, multi_tool=False):
             print("Each tool will use its own spindle speed.\n")
     else:
         # Same-tool mode: report tool size if known
-        tool_sizes = [p['tool_size'] for p in parsed_files]
-        known_sizes = [s for s in tool_sizes if s is not None]
-        if known_sizes:
-            print(f"Tool size: {known_sizes[0]}mm (verified across all files)")
+        if known_tool_size is not None:
+            print(f"Tool size: {known_tool_size}mm (verified across all files)")
+
+    # Transition lines only depend on the heights, so format them once
+    retract_before_line = f"G00 Z{safe_z:.5f} {COMMENT_RETRACT_BEFORE}\n"
+    retract_after_line = f"G00 Z{safe_z:.5f} {COMMENT_RETRACT_AFTER}\n"
+    safety_retract_line = f"G00 Z{tool_change_z:.5f} {COMMENT_SAFETY_RETRACT}\n"
+    dwell_sync_line = f"G4 P0 {COMMENT_DWELL_SYNC}\n"
+
+    # Stream output straight to the file
+    with open(output_file, 'w') as out:
+        # Add explicit state header (defense in depth)
+        out.write(f"( pcb2gcode-combine {'multi-tool' if multi_tool else 'same-tool'} output )\n")
+        out.writelines(generate_state_header())
+
+        # Add filtered header from first file
+        # In multi-tool mode, filter S commands (we set them per tool)
+        # In same-tool mode, keep S commands (header S applies to all operations)
+        header = filter_header_redundant_commands(parsed_files[0]['header'], filter_spindle_speed=multi_tool)
+        out.writelines(header)
+
+        if multi_tool:
+            # Multi-tool mode: insert tool change sequences
+            for i, parsed in enumerate(parsed_files):
+                basename = parsed['basename']
+                tool_number = i + 1
+
+                # Generate tool change sequence
+                tc_lines = generate_tool_change_sequence(
+                    tool_number=tool_number,
+                    tool_size=parsed['tool_size'],
+                    tool_type=parsed['tool_type'],
+                    spindle_speed=parsed['spindle_speed'],
+                    tool_change_z=tool_change_z,
+                    is_first_tool=(i == 0),
+                )
+
+                out.write(f"\n( === Tool {tool_number}: {basename} === )\n")
+                out.writelines(tc_lines)
+
+                # Defense in depth: ensure absolute mode before operations
+                out.write("G90        ( Ensure absolute mode before operations )\n")
+
+                # Add operations (strip leading dwells - we generate our own).
+                # They are the bulk of the output: one joined write is cheaper
+                # than writelines() calling write() per line.
+                ops = strip_leading_dwells(parsed['operations'])
+                if ops:
+                    out.write(''.join(ops))
+
+                    # Ensure we end at safe height
+                    z = parsed['last_operation_scan'].z
+                    if z is None or z < 0:
+                        out.write(retract_after_line)
+        else:
+            # Same-tool mode: use original tool change from first file, concatenate operations
+            out.writelines(parsed_files[0]['tool_change'])
 
-    # Build output
-    output_lines = []
+            # Previous file's speed and feedrate; the first file's own values
+            # are already set by its header
+            prev_speed = parsed_files[0]['spindle_speed']
+            prev_feedrate = parsed_files[0]['feedrate']
 
-    # Add explicit state header (defense in depth)
-    output_lines.append(f"( pcb2gcode-combine {'multi-tool' if multi_tool else 'same-tool'} output )\n")
-    output_lines.extend(generate_state_header())
+            for i, parsed in enumerate(parsed_files):
+                basename = parsed['basename']
 
-    # Add filtered header from first file
-    # In multi-tool mode, filter S commands (we set them per tool)
-    # In same-tool mode, keep S commands (header S applies to all operations)
-    header = filter_header_redundant_commands(parsed_files[0]['header'], filter_spindle_speed=multi_tool)
-    output_lines.extend(header)
+                # Add section comment
+                out.write(f"\n{COMMENT_SECTION.format(basename)}\n")
 
-    if multi_tool:
-        # Multi-tool mode: insert tool change sequences
-        for i, parsed in enumerate(parsed_files):
-            basename = os.path.basename(parsed['filepath'])
-            tool_number = i + 1
-
-            # Generate tool change sequence
-            tc_lines = generate_tool_change_sequence(
-                tool_number=tool_number,
-                tool_size=parsed['tool_size'],
-                tool_type=parsed['tool_type'],
-                spindle_speed=parsed['spindle_speed'],
-                tool_change_z=tool_change_z,
-                is_first_tool=(i == 0),
-            )
-
-            output_lines.append(f"\n( === Tool {tool_number}: {basename} === )\n")
-            output_lines.extend(tc_lines)
-
-            # Defense in depth: ensure absolute mode before operations
-            output_lines.append("G90        ( Ensure absolute mode before operations )\n")
-
-            # Add operations (strip leading dwells - we generate our own)
-            ops = strip_leading_dwells(parsed['operations'])
-            if ops:
-                output_lines.extend(ops)
-
-                # Ensure we end at safe height
-                last_parsed = Line(ops[-1])
-                z = get_z_from_line(last_parsed)
-                if z is None or z < 0:
-                    output_lines.append(f"G00 Z{safe_z:.5f} {COMMENT_RETRACT_AFTER}\n")
-    else:
-        # Same-tool mode: use original tool change from first file, concatenate operations
-        output_lines.extend(parsed_files[0]['tool_change'])
-
-        for i, parsed in enumerate(parsed_files):
-            basename = os.path.basename(parsed['filepath'])
-
-            # Add section comment
-            output_lines.append(f"\n{COMMENT_SECTION.format(basename)}\n")
-
-            # Defense in depth: ensure absolute mode
-            output_lines.append("G90        ( Ensure absolute mode before operations )\n")
-
-            # If not the first file, ensure we're at safe height
-            if i > 0:
-                output_lines.append(f"G00 Z{safe_z:.5f} {COMMENT_RETRACT_BEFORE}\n")
-
-            # Set spindle speed if different from previous file
-            current_speed = parsed['spindle_speed']
-            prev_speed = parsed_files[i - 1]['spindle_speed'] if i > 0 else current_speed
-            if current_speed and current_speed != prev_speed:
-                output_lines.append(f"S{current_speed} {COMMENT_SPINDLE_SPEED.format(basename)}\n")
-
-            # Set feedrate if different from previous file
-            current_feedrate = parsed['feedrate']
-            prev_feedrate = parsed_files[i - 1]['feedrate'] if i > 0 else current_feedrate
-            if current_feedrate and i > 0 and current_feedrate != prev_feedrate:
-                output_lines.append(f"G01 F{current_feedrate:.5f} {COMMENT_FEEDRATE.format(basename)}\n")
-
-            # Add operations
-            ops = parsed['operations']
-            if ops:
-                # Check if operations start with a safe positioning move
-                first_parsed = Line(ops[0])
-                z = get_z_from_line(first_parsed)
-                if not is_rapid_move(first_parsed) or z is None:
-                    output_lines.append(f"G00 Z{tool_change_z:.5f} {COMMENT_SAFETY_RETRACT}\n")
-                    output_lines.append(f"G4 P0 {COMMENT_DWELL_SYNC}\n")
-
-                output_lines.extend(ops)
-
-                # Ensure we end at safe height
-                last_parsed = Line(ops[-1])
-                z = get_z_from_line(last_parsed)
-                if z is None or z < 0:
-                    output_lines.append(f"G00 Z{safe_z:.5f} {COMMENT_RETRACT_AFTER}\n")
-
-    # Add footer from last file
-    output_lines.extend(parsed_files[-1]['footer'])
-
-    # Write output
-    with open(output_file, 'w') as f:
-        f.writelines(output_lines)
+                # Defense in depth: ensure absolute mode
+                out.write("G90        ( Ensure absolute mode before operations )\n")
+
+                # If not the first file, ensure we're at safe height
+                if i > 0:
+                    out.write(retract_before_line)
+
+                # Set spindle speed if different from previous file
+                current_speed = parsed['spindle_speed']
+                if current_speed and current_speed != prev_speed:
+                    out.write(f"S{current_speed} {COMMENT_SPINDLE_SPEED.format(basename)}\n")
+
+                # Set feedrate if different from previous file
+                current_feedrate = parsed['feedrate']
+                if current_feedrate and current_feedrate != prev_feedrate:
+                    out.write(f"G01 F{current_feedrate:.5f} {COMMENT_FEEDRATE.format(basename)}\n")
+
+                # Add operations
+                ops = parsed['operations']
+                if ops:
+                    # Check if operations start with a safe positioning move
+                    first_scan = parsed['first_operation_scan']
+                    if not first_scan.is_rapid or first_scan.z is None:
+                        out.write(safety_retract_line)
+                        out.write(dwell_sync_line)
+
+                    out.write(''.join(ops))
+
+                    # Ensure we end at safe height
+                    z = parsed['last_operation_scan'].z
+                    if z is None or z < 0:
+                        out.write(retract_after_line)
+
+                prev_speed = current_speed
+                prev_feedrate = current_feedrate
+
+        # Add footer from last file
+        out.writelines(parsed_files[-1]['footer'])
 
     total_ops = sum(len(p['operations']) for p in parsed_files)
     if multi_tool:
@@ -274,7 +299,7 @@ def combine_files(input_files, output_file, multi_tool=False):
     return True
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="""
         Combine multiple pcb2gcode G-code files into a single file.
@@ -298,7 +323,7 @@ def main():
     parser.add_argument("--multi", action="store_true",
                         help="Allow different tools with M6 tool change sequences")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if len(args.input_files) < 2:
         print("Error: Need at least 2 input files to combine.", file=sys.stderr)
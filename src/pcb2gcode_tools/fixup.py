@@ -480,9 +480,11 @@ def fix_full_circle_arcs(infile, outfile):
     return arcs_fixed
 
 
-def main():
+def main(argv=None):
     """
     Main function to process command line arguments and execute G-code modifications.
+
+    argv defaults to sys.argv[1:]; the wrapper passes its own list to run in-process.
     """
     parser = argparse.ArgumentParser(
         description="""
@@ -505,7 +507,7 @@ def main():
                             "These are typically Voronoi artifacts that create useless tiny dots. "
                             "Set to 0 to disable.")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Check if input file exists
     if not os.path.exists(args.infile):
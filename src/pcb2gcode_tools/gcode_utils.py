@@ -8,8 +8,10 @@ This module provides common functionality for combine.py and multitool.py:
 - Helper functions for Z height detection, spindle control, etc.
 """
 
+import bisect
 import os
 import re
+from collections import namedtuple
 from pygcode import Line, GCodeRapidMove, GCodeLinearMove, GCodeSpindleSpeed, \
     GCodeFeedRate, GCodeStartSpindleCW, GCodeStopSpindle
 
@@ -48,11 +50,11 @@ DANGEROUS_GCODES = {
     'G30': 'Secondary home - may crash into workpiece',
 }
 
-# Parser states
-STATE_HEADER = 'header'
-STATE_TOOL_CHANGE = 'tool_change'
-STATE_OPERATIONS = 'operations'
-STATE_FOOTER = 'footer'
+# Any dangerous G-code, matched anywhere in the file in a single pass
+_DANGEROUS_RE = re.compile('|'.join(re.escape(code) for code in DANGEROUS_GCODES), re.IGNORECASE)
+
+# Parser states (indices into _STATE_HANDLERS)
+STATE_HEADER, STATE_TOOL_CHANGE, STATE_OPERATIONS, STATE_FOOTER = range(4)
 
 # Tool size patterns in comments
 TOOL_SIZE_PATTERNS = [
@@ -62,6 +64,9 @@ TOOL_SIZE_PATTERNS = [
     r'Bit sizes:\s*\[([0-9.]+)mm\]',
 ]
 
+# All tool size patterns as one regex, so a comment is searched only once
+_TOOL_SIZE_RE = re.compile('|'.join(f'(?:{p})' for p in TOOL_SIZE_PATTERNS), re.IGNORECASE)
+
 # Tool type patterns - used to describe the tool in MSG comments
 TOOL_TYPE_PATTERNS = [
     (r'drill', 'drill'),
@@ -70,6 +75,7 @@ TOOL_TYPE_PATTERNS = [
     (r'back', 'isolation mill'),
     (r'front', 'isolation mill'),
 ]
+_TOOL_TYPE_RES = [(re.compile(pattern), tool_type) for pattern, tool_type in TOOL_TYPE_PATTERNS]
 
 # G-code comment templates
 COMMENT_SECTION = "( === Operations from {} === )"
@@ -80,6 +86,16 @@ COMMENT_DWELL_SYNC = "( dwell to ensure Z complete before XY )"
 COMMENT_SPINDLE_SPEED = "( spindle speed for {} )"
 COMMENT_FEEDRATE = "( feedrate for {} )"
 
+# Fast line scanning: G-code words and comments we care about while parsing
+_TOKEN_RE = re.compile(r'([GMSFZ])\s*([-+]?(?:\d+\.?\d*|\.\d+))', re.IGNORECASE)
+_COMMENT_RE = re.compile(r'\(([^)]*)\)|;(.*)')
+
+# Result of scanning a single raw line (see _fast_scan)
+LineScan = namedtuple('LineScan', [
+    'z', 'spindle_speed', 'feedrate', 'has_m3', 'has_m5', 'is_rapid', 'units', 'comment',
+])
+_EMPTY_SCAN = LineScan(None, None, None, False, False, False, None, None)
+
 # =============================================================================
 # Helper Functions
 # =============================================================================
@@ -146,41 +162,217 @@ def is_rapid_move(line):
 
 def extract_tool_size(parsed_line):
     """Extract tool/bit size from a parsed G-code line's comment."""
-    if not parsed_line.comment:
+    comment = parsed_line.comment
+    if comment is None:
         return None
+    return extract_tool_size_from_text(comment.text)
 
-    comment_text = parsed_line.comment.text
-    for pattern in TOOL_SIZE_PATTERNS:
-        m = re.search(pattern, comment_text, re.IGNORECASE)
-        if m:
-            return float(m.group(1))
+
+def extract_tool_size_from_text(comment_text):
+    """Extract tool/bit size from comment text."""
+    m = _TOOL_SIZE_RE.search(comment_text)
+    if m:
+        # Each alternative has one group, so the last matched is the size
+        return float(m.group(m.lastindex))
     return None
 
 
 def infer_tool_type(filepath):
     """Infer tool type from filename."""
     basename = os.path.basename(filepath).lower()
-    for pattern, tool_type in TOOL_TYPE_PATTERNS:
-        if re.search(pattern, basename):
+    for pattern, tool_type in _TOOL_TYPE_RES:
+        if pattern.search(basename):
             return tool_type
     return 'tool'
 
 
+def find_dangerous_commands(text):
+    """
+    Find dangerous G-codes anywhere in a file's text.
+
+    Returns list of (line_num, code, reason) tuples, one per code per line.
+    """
+    dangerous_commands = []
+    seen = set()
+    line_num = 1
+    line_start = 0
+    for m in _DANGEROUS_RE.finditer(text):
+        line_num += text.count('\n', line_start, m.start())
+        line_start = m.start()
+        code = m.group(0).upper()
+        if (line_num, code) not in seen:
+            seen.add((line_num, code))
+            dangerous_commands.append((line_num, code, DANGEROUS_GCODES[code]))
+    return dangerous_commands
+
+
+def _fast_scan(raw_line):
+    """
+    Scan a raw G-code line for the handful of words the parser needs.
+
+    This is a lightweight alternative to pygcode's Line() for the per-line
+    hot loop: a single regex pass over the line instead of a full parse.
+    Z is only reported on G0/G1 moves, matching get_z_from_line().
+
+    Returns a LineScan namedtuple.
+    """
+    # Cheap substring checks first: most lines are blank or have no comment
+    if not raw_line or raw_line.isspace():
+        return _EMPTY_SCAN
+
+    comment = None
+    code = raw_line
+    if '(' in raw_line or ';' in raw_line:
+        comments = _COMMENT_RE.findall(raw_line)
+        if comments:
+            comment = '. '.join(paren or semicolon for paren, semicolon in comments)
+            code = _COMMENT_RE.sub(' ', raw_line)
+            # Comment-only lines carry no words to tokenize
+            if code.isspace():
+                return LineScan(None, None, None, False, False, False, None, comment)
+
+    z = spindle_speed = feedrate = units = None
+    has_m3 = has_m5 = is_rapid = is_motion = False
+    for letter, number in _TOKEN_RE.findall(code):
+        letter = letter.upper()
+        value = float(number)
+        if letter == 'G':
+            if value == 0:
+                is_rapid = is_motion = True
+            elif value == 1:
+                is_motion = True
+            elif value == 20:
+                units = UNITS_INCHES
+            elif value == 21:
+                units = UNITS_MM
+        elif letter == 'M':
+            if value == 3:
+                has_m3 = True
+            elif value == 5:
+                has_m5 = True
+        elif letter == 'S':
+            spindle_speed = int(value)
+        elif letter == 'F':
+            feedrate = value
+        elif letter == 'Z':
+            z = value
+
+    return LineScan(z if is_motion else None, spindle_speed, feedrate,
+                    has_m3, has_m5, is_rapid, units, comment)
+
+
 # =============================================================================
 # G-code File Parsing
 # =============================================================================
 
 
+def _parse_header_line(ctx, i, raw_line, scan):
+    """Header state: setup lines up to the tool change retract (or M3)."""
+    # Extract spindle speed from header
+    if scan.spindle_speed is not None:
+        ctx['spindle_speed'] = scan.spindle_speed
+
+    # Extract feedrate
+    if scan.feedrate is not None:
+        ctx['feedrate'] = scan.feedrate
+
+    # Header ends when we see retract to tool change height
+    if is_tool_change_height(scan.z):
+        ctx['tool_change_z'] = scan.z
+        ctx['tool_change'].append(raw_line)
+        return STATE_TOOL_CHANGE
+
+    # For millready files (no tool change), M3 signals end of header
+    if scan.has_m3:
+        ctx['saw_m3'] = True  # M3 was just seen
+        ctx['tool_change'].append(raw_line)
+        return STATE_TOOL_CHANGE
+
+    ctx['header'].append(raw_line)
+    return STATE_HEADER
+
+
+def _parse_tool_change_line(ctx, i, raw_line, scan):
+    """Tool change state: everything up to and including M3."""
+    # Extract spindle speed if not found in header (pcb2gcode often puts S on M3 line)
+    if ctx['spindle_speed'] is None:
+        ctx['spindle_speed'] = scan.spindle_speed
+
+    # Track M3 (spindle on)
+    if scan.has_m3:
+        ctx['saw_m3'] = True
+        ctx['tool_change'].append(raw_line)
+        return STATE_TOOL_CHANGE
+
+    # After M3, everything goes to operations (including G04 dwell)
+    if ctx['saw_m3']:
+        ctx['operations'].append(raw_line)
+        ctx['first_operation_scan'] = ctx['last_operation_scan'] = scan
+        # Extract safe_z if this is a safe Z move
+        if is_safe_height(scan.z):
+            ctx['safe_z'] = scan.z
+        return STATE_OPERATIONS
+
+    ctx['tool_change'].append(raw_line)
+    return STATE_TOOL_CHANGE
+
+
+def _parse_operations_line(ctx, i, raw_line, scan):
+    """Operations state: cutting moves up to the final retract."""
+    # Extract safe_z from first positive Z rapid move if not yet found
+    if ctx['safe_z'] is None and is_safe_height(scan.z):
+        ctx['safe_z'] = scan.z
+
+    # Extract feedrate from operations if not found in header
+    if ctx['feedrate'] is None:
+        ctx['feedrate'] = scan.feedrate
+
+    # Footer starts at "All done" comment or final high Z retract before M5
+    if scan.comment and 'All done' in scan.comment:
+        ctx['footer'].append(raw_line)
+        return STATE_FOOTER
+
+    # Check for final retract (high Z followed within 4 lines by M5)
+    if is_tool_change_height(scan.z):
+        m5_lines = ctx['m5_lines']
+        next_m5 = bisect.bisect_right(m5_lines, i)
+        if next_m5 < len(m5_lines) and m5_lines[next_m5] < i + 5:
+            ctx['footer'].append(raw_line)
+            return STATE_FOOTER
+
+    ctx['operations'].append(raw_line)
+    ctx['last_operation_scan'] = scan
+    return STATE_OPERATIONS
+
+
+def _parse_footer_line(ctx, i, raw_line, scan):
+    """Footer state: everything after the final retract."""
+    ctx['footer'].append(raw_line)
+    return STATE_FOOTER
+
+
+_STATE_HANDLERS = (
+    _parse_header_line,
+    _parse_tool_change_line,
+    _parse_operations_line,
+    _parse_footer_line,
+)
+
+
 def parse_gcode_file(filepath):
     """
-    Parse a G-code file into sections using pygcode.
+    Parse a G-code file into sections.
 
     Returns:
         dict with keys:
             - header: list of raw lines
             - tool_change: list of raw lines
             - operations: list of raw lines
+            - first_operation_scan: LineScan of the first operation line, or None
+            - last_operation_scan: LineScan of the last operation line, or None
             - footer: list of raw lines
+            - filepath: path the file was read from
+            - basename: file name without its directory
             - spindle_speed: int or None
             - feedrate: float or None
             - safe_z: float (working safe height)
@@ -191,148 +383,73 @@ def parse_gcode_file(filepath):
             - dangerous_commands: list of (line_num, code, reason) tuples
     """
     with open(filepath, 'r') as f:
-        raw_lines = f.readlines()
-
-    header = []
-    tool_change = []
-    operations = []
-    footer = []
+        data = f.read()
+    # Share one str object per distinct line: pcb2gcode output repeats
+    # many lines verbatim, and the sections keep every line alive
+    distinct_lines = {}
+    raw_lines = [distinct_lines.setdefault(raw_line, raw_line)
+                 for raw_line in data.splitlines(keepends=True)]
+
+    # Scan every line once up front; the look-ahead below reuses these.
+    # Repeated lines (retracts, plunges, feedrates, dwells) are only
+    # scanned the first time.
+    scan_cache = {}
+    scans = []
+    for raw_line in raw_lines:
+        scan = scan_cache.get(raw_line)
+        if scan is None:
+            scan = scan_cache[raw_line] = _fast_scan(raw_line)
+        scans.append(scan)
+
+    # Section lists and values the state handlers fill in
+    ctx = {
+        'header': [],
+        'tool_change': [],
+        'operations': [],
+        'first_operation_scan': None,
+        'last_operation_scan': None,
+        'footer': [],
+        'spindle_speed': None,
+        'feedrate': None,
+        'safe_z': None,  # Must be extracted from file
+        'tool_change_z': None,  # Tool change height (e.g., Z35)
+        'saw_m3': False,
+        'm5_lines': [i for i, scan in enumerate(scans) if scan.has_m5],
+    }
 
     state = STATE_HEADER
-    spindle_speed = None
-    feedrate = None
-    safe_z = None  # Must be extracted from file
-    tool_change_z = None  # Tool change height (e.g., Z35)
-    saw_m3 = False
     tool_size = None
     units = None  # 'mm' or 'inches'
-    dangerous_commands = []  # List of dangerous commands found
 
-    for i, raw_line in enumerate(raw_lines):
-        parsed = Line(raw_line)
-
-        # Extract tool size from any comment
-        if tool_size is None:
-            tool_size = extract_tool_size(parsed)
+    for i, (raw_line, scan) in enumerate(zip(raw_lines, scans)):
+        # Extract tool size from comments; pcb2gcode only writes it in the
+        # header and tool change sections, never among the operations
+        if tool_size is None and scan.comment and state <= STATE_TOOL_CHANGE:
+            tool_size = extract_tool_size_from_text(scan.comment)
 
         # Detect units (G20=inches, G21=mm)
-        for gc in parsed.gcodes:
-            if hasattr(gc, 'word'):
-                if gc.word.letter == 'G' and gc.word.value == 20:
-                    units = UNITS_INCHES
-                elif gc.word.letter == 'G' and gc.word.value == 21:
-                    units = UNITS_MM
-
-        # Detect dangerous commands
-        line_upper = raw_line.upper().strip()
-        for dangerous_code, reason in DANGEROUS_GCODES.items():
-            if dangerous_code in line_upper:
-                dangerous_commands.append((i + 1, dangerous_code, reason))
-
-        if state == STATE_HEADER:
-            # Extract spindle speed from header
-            s = get_spindle_speed(parsed)
-            if s is not None:
-                spindle_speed = s
-
-            # Extract feedrate
-            f = get_feedrate(parsed)
-            if f is not None:
-                feedrate = f
-
-            # Header ends when we see retract to tool change height
-            z = get_z_from_line(parsed)
-            if is_tool_change_height(z):
-                tool_change_z = z
-                state = STATE_TOOL_CHANGE
-                tool_change.append(raw_line)
-                continue
-
-            # For millready files (no tool change), M3 signals end of header
-            if has_spindle_on(parsed):
-                state = STATE_TOOL_CHANGE
-                saw_m3 = True  # M3 was just seen
-                tool_change.append(raw_line)
-                continue
-
-            header.append(raw_line)
+        if scan.units is not None:
+            units = scan.units
 
-        elif state == STATE_TOOL_CHANGE:
-            # Extract spindle speed if not found in header (pcb2gcode often puts S on M3 line)
-            if spindle_speed is None:
-                s = get_spindle_speed(parsed)
-                if s is not None:
-                    spindle_speed = s
-
-            # Track M3 (spindle on)
-            if has_spindle_on(parsed):
-                saw_m3 = True
-                tool_change.append(raw_line)
-                continue
-
-            # After M3, everything goes to operations (including G04 dwell)
-            if saw_m3:
-                state = STATE_OPERATIONS
-                operations.append(raw_line)
-                # Extract safe_z if this is a safe Z move
-                z = get_z_from_line(parsed)
-                if z is not None and is_safe_height(z):
-                    safe_z = z
-                continue
-
-            tool_change.append(raw_line)
-
-        elif state == STATE_OPERATIONS:
-            # Extract safe_z from first positive Z rapid move if not yet found
-            if safe_z is None:
-                z = get_z_from_line(parsed)
-                if z is not None and is_safe_height(z):
-                    safe_z = z
-
-            # Extract feedrate from operations if not found in header
-            if feedrate is None:
-                f = get_feedrate(parsed)
-                if f is not None:
-                    feedrate = f
-
-            # Footer starts at "All done" comment or final high Z retract before M5
-            if parsed.comment and 'All done' in parsed.comment.text:
-                state = STATE_FOOTER
-                footer.append(raw_line)
-                continue
-
-            # Check for final retract (high Z followed soon by M5)
-            z = get_z_from_line(parsed)
-            if is_tool_change_height(z):
-                # Look ahead for M5
-                for j in range(i + 1, min(i + 5, len(raw_lines))):
-                    future_parsed = Line(raw_lines[j])
-                    if has_spindle_off(future_parsed):
-                        state = STATE_FOOTER
-                        footer.append(raw_line)
-                        break
-                if state == STATE_FOOTER:
-                    continue
-
-            operations.append(raw_line)
-
-        elif state == STATE_FOOTER:
-            footer.append(raw_line)
+        state = _STATE_HANDLERS[state](ctx, i, raw_line, scan)
 
     return {
-        'header': header,
-        'tool_change': tool_change,
-        'operations': operations,
-        'footer': footer,
+        'header': ctx['header'],
+        'tool_change': ctx['tool_change'],
+        'operations': ctx['operations'],
+        'first_operation_scan': ctx['first_operation_scan'],
+        'last_operation_scan': ctx['last_operation_scan'],
+        'footer': ctx['footer'],
         'filepath': filepath,
-        'spindle_speed': spindle_speed,
-        'feedrate': feedrate,
-        'safe_z': safe_z,
-        'tool_change_z': tool_change_z,
+        'basename': os.path.basename(filepath),
+        'spindle_speed': ctx['spindle_speed'],
+        'feedrate': ctx['feedrate'],
+        'safe_z': ctx['safe_z'],
+        'tool_change_z': ctx['tool_change_z'],
         'tool_size': tool_size,
         'tool_type': infer_tool_type(filepath),
         'units': units,
-        'dangerous_commands': dangerous_commands,
+        'dangerous_commands': find_dangerous_commands(data),
     }
 
 
@@ -360,7 +477,7 @@ def validate_files_for_combining(parsed_files, require_same_tool=False):
     # Check for unit consistency
     units_found = {}
     for p in parsed_files:
-        name = os.path.basename(p['filepath'])
+        name = p['basename']
         if p['units']:
             units_found[name] = p['units']
 
@@ -378,7 +495,7 @@ def validate_files_for_combining(parsed_files, require_same_tool=False):
 
     # Check for missing spindle speed
     for p in parsed_files:
-        name = os.path.basename(p['filepath'])
+        name = p['basename']
         if p['spindle_speed'] is None:
             errors.append(f"FATAL: {name} has no spindle speed - cannot determine safe RPM")
         elif p['spindle_speed'] < MIN_SPINDLE_SPEED:
@@ -388,12 +505,12 @@ def validate_files_for_combining(parsed_files, require_same_tool=False):
 
     # Check for dangerous commands
     for p in parsed_files:
-        name = os.path.basename(p['filepath'])
+        name = p['basename']
         for line_num, code, reason in p['dangerous_commands']:
             errors.append(f"FATAL: {name} line {line_num}: {code} - {reason}")
 
     # Check for safe_z consistency
-    safe_z_values = [(os.path.basename(p['filepath']), p['safe_z'])
+    safe_z_values = [(p['basename'], p['safe_z'])
                      for p in parsed_files if p['safe_z'] is not None]
     if safe_z_values:
         z_values = [z for _, z in safe_z_values]
@@ -405,7 +522,7 @@ def validate_files_for_combining(parsed_files, require_same_tool=False):
             warnings.append("This may indicate files from different setups.")
 
     # Check for missing safe_z
-    missing_safe_z = [os.path.basename(p['filepath'])
+    missing_safe_z = [p['basename']
                       for p in parsed_files if p['safe_z'] is None]
     if missing_safe_z:
         warnings.append(f"WARNING: Could not detect safe Z height in: {', '.join(missing_safe_z)}")
@@ -413,23 +530,31 @@ def validate_files_for_combining(parsed_files, require_same_tool=False):
 
     # Check tool sizes match if required
     if require_same_tool:
-        tool_sizes = [p['tool_size'] for p in parsed_files]
-        known_sizes = [s for s in tool_sizes if s is not None]
-
-        if known_sizes:
-            unique_sizes = set(known_sizes)
-            if len(unique_sizes) > 1:
-                errors.append("FATAL: Tool sizes don't match!")
-                for p in parsed_files:
-                    size = p['tool_size']
-                    name = os.path.basename(p['filepath'])
-                    if size:
-                        errors.append(f"  {name}: {size}mm")
-                    else:
-                        errors.append(f"  {name}: unknown")
-                errors.append("Combining files with different tool sizes requires --multi mode (pcb2gcode-multitool).")
-        else:
+        # Stop at the first known size that differs from the first known one
+        first_size = None
+        sizes_match = True
+        for p in parsed_files:
+            size = p['tool_size']
+            if size is None:
+                continue
+            if first_size is None:
+                first_size = size
+            elif size != first_size:
+                sizes_match = False
+                break
+
+        if first_size is None:
             warnings.append("Warning: Could not determine tool sizes from any file")
+        elif not sizes_match:
+            errors.append("FATAL: Tool sizes don't match!")
+            for p in parsed_files:
+                size = p['tool_size']
+                name = p['basename']
+                if size:
+                    errors.append(f"  {name}: {size}mm")
+                else:
+                    errors.append(f"  {name}: unknown")
+            errors.append("Combining files with different tool sizes requires --multi mode (pcb2gcode-multitool).")
 
     is_valid = len(errors) == 0
     return is_valid, errors, warnings
@@ -492,18 +617,21 @@ def filter_header_redundant_commands(header_lines, filter_spindle_speed=True):
     filtered = []
 
     for line in header_lines:
-        parsed_line = Line(line)
+        # Only G and S words matter here, so tokenize the code part of the
+        # line with _TOKEN_RE rather than a full pygcode parse
+        code = _COMMENT_RE.sub(' ', line) if '(' in line or ';' in line else line
+        tokens = [(letter.upper(), number) for letter, number in _TOKEN_RE.findall(code)]
 
         # Skip lines with spindle speed if filtering is enabled (multi-tool mode)
         if filter_spindle_speed:
-            has_spindle_speed = any(isinstance(gc, GCodeSpindleSpeed) for gc in parsed_line.gcodes)
+            has_spindle_speed = any(letter == 'S' for letter, _ in tokens)
             if has_spindle_speed:
                 continue
 
         # Check if line contains only state commands we already set
-        gcode_words = [gc.word.letter + str(int(gc.word.value))
-                       for gc in parsed_line.gcodes
-                       if hasattr(gc, 'word') and gc.word.letter == 'G']
+        gcode_words = ['G' + str(int(float(number)))
+                       for letter, number in tokens
+                       if letter == 'G']
         is_redundant_state = all(word in state_commands for word in gcode_words) and gcode_words
         if is_redundant_state:
             continue
@@ -513,6 +641,10 @@ def filter_header_redundant_commands(header_lines, filter_spindle_speed=True):
     return filtered
 
 
+# Line prefixes (after strip/upper) that mark a dwell command
+_DWELL_PREFIXES = ('G4 ', 'G04', 'G4P')
+
+
 def strip_leading_dwells(operations):
     """
     Strip leading G04/G4 dwell commands from operations.
@@ -524,9 +656,8 @@ def strip_leading_dwells(operations):
     """
     start_idx = 0
     for idx, line in enumerate(operations):
-        stripped = line.strip().upper()
         # Check for G4 or G04 at start of line (dwell command)
-        if stripped.startswith('G4 ') or stripped.startswith('G04') or stripped.startswith('G4P'):
+        if line.strip().upper().startswith(_DWELL_PREFIXES):
             start_idx = idx + 1
         else:
             break
@@ -12,18 +12,22 @@ pcb2gcode-fixup and pcb2gcode-combine on the output files.
 """
 
 import argparse
+import functools
 import math
 import os
 import re
-import shutil
+import shlex
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from . import combine, fixup
 
 # Default margins: additional space added to board dimensions for offset calculations
 DEFAULT_X_MARGIN = 5
 DEFAULT_Y_MARGIN = 3
 
-# Tool commands - these are entry points from the same package
+# Tool commands - these are entry points from the same package, run in-process
 FIXUP_CMD = 'pcb2gcode-fixup'
 COMBINE_CMD = 'pcb2gcode-combine'
 
@@ -38,6 +42,15 @@ OUTPUT_DRILL = '_drill'
 OUTPUT_MILLDRILL = '_milldrill'
 OUTPUT_OUTLINE = '_outline'
 
+# pcb2gcode runs: (description, mode flag, input suffix, extra flags,
+# output suffixes to fix up afterwards)
+PIPELINE = [
+    ("Processing back copper", '--back', INPUT_BACK_COPPER, (), (OUTPUT_BACK,)),
+    ("Processing drill holes", '--drill', INPUT_DRILL, ('--drill-side', 'back'),
+     (OUTPUT_DRILL, OUTPUT_MILLDRILL)),
+    ("Processing board outline", '--outline', INPUT_EDGE_CUTS, ('--cut-side', 'back'), (OUTPUT_OUTLINE,)),
+]
+
 # Combined output file suffixes (without .ngc)
 OUTPUT_000_ALL = '_000_all'
 OUTPUT_00_BACK = '_00_back'
@@ -47,6 +60,14 @@ OUTPUT_01_DRILL = '_01_drill'
 EXT_NGC = '.ngc'
 EXT_FIXUP = '-fixup.ngc'
 
+# Gerber patterns, compiled once. Gerber files are ASCII, so they match
+# bytes; extract_coordinates runs the MULTILINE ones over the whole file.
+# Format and units directives in one pattern: groups 1-4 are the FSLAX
+# digits, group 5 is the MO unit (MM or IN)
+_HEADER_RE = re.compile(rb'^%(?:FSLAX(\d)(\d)Y(\d)(\d)|MO(MM|IN))\*%', re.MULTILINE)
+_COORD_RE = re.compile(rb'^X(-?\d+)Y(-?\d+)', re.MULTILINE)
+_END_OF_FILE_RE = re.compile(rb'^M02', re.MULTILINE)
+
 
 def output_path(output_dir, basename, suffix, ext=EXT_NGC):
     """Build an output file path."""
@@ -54,61 +75,59 @@ def output_path(output_dir, basename, suffix, ext=EXT_NGC):
     return f"{prefix}{basename}{suffix}{ext}"
 
 
-def parse_fslax_format(line):
-    """Parse FSLAX format specification from Gerber header."""
-    match = re.match(r'%FSLAX(\d)(\d)Y(\d)(\d)\*%', line)
-    if not match:
-        return None
+def parse_fslax_format(match):
+    """Parse FSLAX format specification from a _HEADER_RE match on a Gerber header line."""
+    x_integer = int(match.group(1))
     x_decimal = int(match.group(2))
     units_factor = 10.0 ** x_decimal
-    print(f"Detected Gerber format: {match.group(1)}.{x_decimal}, units factor: {units_factor}")
+    print(f"Detected Gerber format: {x_integer}.{x_decimal}, units factor: {units_factor}")
     return units_factor
 
 
-def parse_gerber_units(line, units_factor, millimeter_units):
-    """Parse units specification from Gerber header line."""
-    if re.match(r'%FSLAX(\d)(\d)Y(\d)(\d)\*%', line):
-        new_factor = parse_fslax_format(line)
-        if new_factor:
-            units_factor = new_factor
-    elif '%MOMM*%' in line:
+def parse_gerber_units(match, units_factor, millimeter_units):
+    """Apply a _HEADER_RE match (format or units directive) to the units settings."""
+    unit = match.group(5)
+    if unit is None:
+        units_factor = parse_fslax_format(match)
+    elif unit == b'MM':
         print('Detected millimeter units in Gerber file')
         units_factor = 1_000_000.0
         millimeter_units = True
-    elif '%MOIN*%' in line:
+    else:
         print('Detected inch units in Gerber file')
     return units_factor, millimeter_units
 
 
-def update_coordinate_bounds(line, xmin, xmax, ymin, ymax):
-    """Extract coordinates from Gerber line and update bounds."""
-    match = re.match(r'^X([\d-]+)Y([\d-]+)', line)
-    if not match:
-        return xmin, xmax, ymin, ymax
+def extract_coordinates(filename):
+    """Extract coordinates from Gerber file."""
+    units_factor = 10_000.0  # Default: decimills to inches
+    millimeter_units = False
 
-    x = int(match.group(1))
-    y = int(match.group(2))
+    with open(filename, 'rb') as f:
+        data = f.read()
 
-    xmin = min(xmin, x) if xmin is not None else x
-    xmax = max(xmax, x) if xmax is not None else x
-    ymin = min(ymin, y) if ymin is not None else y
-    ymax = max(ymax, y) if ymax is not None else y
+    # Nothing after the M02 end-of-file command belongs to the image
+    end_match = _END_OF_FILE_RE.search(data)
+    end = end_match.start() if end_match else len(data)
 
-    return xmin, xmax, ymin, ymax
+    # Format and units directives are extended commands, on lines starting with '%'
+    for match in _HEADER_RE.finditer(data, 0, end):
+        units_factor, millimeter_units = parse_gerber_units(match, units_factor, millimeter_units)
 
+    # Collect every X/Y coordinate in one pass, then reduce once
+    coords = _COORD_RE.findall(data, 0, end)
+    if not coords:
+        return None, None, None, None, units_factor, millimeter_units
+    xs = [int(x) for x, _ in coords]
+    ys = [int(y) for _, y in coords]
 
-def extract_coordinates(filename):
-    """Extract coordinates from Gerber file."""
-    xmin = xmax = ymin = ymax = None
-    units_factor = 10_000.0  # Default: decimills to inches
-    millimeter_units = False
+    return min(xs), max(xs), min(ys), max(ys), units_factor, millimeter_units
 
-    with open(filename, 'r') as f:
-        for line in f:
-            units_factor, millimeter_units = parse_gerber_units(line, units_factor, millimeter_units)
-            xmin, xmax, ymin, ymax = update_coordinate_bounds(line, xmin, xmax, ymin, ymax)
 
-    return xmin, xmax, ymin, ymax, units_factor, millimeter_units
+@functools.lru_cache(maxsize=4)
+def _cached_dimensions(filename, mtime_ns, size):
+    """extract_coordinates() for a Gerber file; mtime_ns and size only key the cache."""
+    return extract_coordinates(filename)
 
 
 def convert_to_inches(width, height, units_factor, millimeter_units):
@@ -126,7 +145,9 @@ def parse_gerber_dimensions(filename, x_margin):
     if not os.path.exists(filename):
         return None
 
-    xmin, xmax, ymin, ymax, units_factor, millimeter_units = extract_coordinates(filename)
+    st = os.stat(filename)
+    xmin, xmax, ymin, ymax, units_factor, millimeter_units = _cached_dimensions(
+        filename, st.st_mtime_ns, st.st_size)
     if xmin is None or xmax is None:
         return None
 
@@ -145,27 +166,58 @@ def parse_gerber_dimensions(filename, x_margin):
     return offset
 
 
-def command_available(cmd):
-    """Check if a command is available in PATH."""
-    return shutil.which(cmd) is not None
-
-
-def run_command(cmd, description=None):
-    """Run a command and handle errors."""
+def run_tool(tool_main, argv):
+    """
+    Run one of this package's command-line tools in-process.
+
+    Saves starting another Python interpreter for every fixup and combine.
+    argv[0] is the command name, used for display only.
+
+    Returns the tool's exit status.
+    """
+    print(f"Running: {shlex.join(argv)}")
+    try:
+        tool_main(argv[1:])
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        return 1
+    except Exception as e:
+        print(f"Error running {argv[0]}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_command(argv, description=None, started=None):
+    """
+    Run a command (an argv list, no shell) and handle errors.
+
+    If started is given, it is a Future for the same command already
+    running with its output captured: wait for it and print that output
+    as one block instead of running the command again.
+    """
     if description:
         print(f"\n{description}...")
+    cmd = shlex.join(argv)
     print(f"Running: {cmd}")
-    result = subprocess.run(cmd, shell=True)
+    try:
+        if started is None:
+            result = subprocess.run(argv)
+        else:
+            result = started.result()
+            sys.stdout.write(result.stdout)
+            sys.stdout.flush()
+            sys.stderr.write(result.stderr)
+    except OSError as e:
+        print(f"Error executing command: {cmd}: {e}", file=sys.stderr)
+        sys.exit(1)
     if result.returncode != 0:
         print(f"Error executing command: {cmd}", file=sys.stderr)
         sys.exit(1)
 
 
-def run_fixup(output_dir, basename, suffix, fixup_available):
-    """Run pcb2gcode-fixup on an NGC file if available."""
-    if not fixup_available:
-        return
-
+def run_fixup(output_dir, basename, suffix):
+    """Run pcb2gcode-fixup on an NGC file."""
     input_file = output_path(output_dir, basename, suffix)
     fixup_file = output_path(output_dir, basename, suffix, EXT_FIXUP)
 
@@ -181,18 +233,65 @@ def run_fixup(output_dir, basename, suffix, fixup_available):
             print(f"Warning: {basename}{suffix}{EXT_NGC} not found in {dir_desc}")
             return
 
-    cmd = f"{FIXUP_CMD} --remove-m6 {input_file} {fixup_file}"
-    print(f"Running: {cmd}")
-    result = subprocess.run(cmd, shell=True)
-    if result.returncode != 0:
+    if run_tool(fixup.main, [FIXUP_CMD, '--remove-m6', input_file, fixup_file]) != 0:
         print(f"Warning: {FIXUP_CMD} failed on {input_file}")
 
 
-def run_combine(output_dir, basename, input_suffixes, output_suffix, fixup_available):
-    """Run pcb2gcode-combine on multiple files."""
-    ext = EXT_FIXUP if fixup_available else EXT_NGC
-    input_files = [output_path(output_dir, basename, s, ext) for s in input_suffixes]
-    existing_files = [f for f in input_files if os.path.exists(f)]
+def run_pcb2gcode(description, cmd, output_dir, basename, suffixes, started=None):
+    """Run one pcb2gcode invocation, then fix up each of its output files."""
+    run_command(cmd, description, started)
+    for suffix in suffixes:
+        run_fixup(output_dir, basename, suffix)
+
+
+def run_pcb2gcode_all(runs, jobs, output_dir, basename):
+    """
+    Run the pcb2gcode invocations, up to jobs of them at a time.
+
+    Args:
+        runs: List of (description, cmd, output suffixes) tuples
+        jobs: Maximum number of pcb2gcode processes running at once
+    """
+    if jobs <= 1:
+        for description, cmd, suffixes in runs:
+            run_pcb2gcode(description, cmd, output_dir, basename, suffixes)
+        return
+
+    # Each pcb2gcode process reads its own input and writes its own outputs,
+    # so start them side by side with their output captured. Then, in order,
+    # print each run's output as one block and fix up its files, so messages
+    # stay grouped per run (the in-process fixups would only take turns on
+    # the GIL if run in threads).
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(subprocess.run, cmd, capture_output=True, text=True, errors='replace')
+                   for _, cmd, _ in runs]
+        for (description, cmd, suffixes), future in zip(runs, futures):
+            run_pcb2gcode(description, cmd, output_dir, basename, suffixes, started=future)
+
+
+def existing_outputs(paths):
+    """Return the paths that exist, scanning each containing directory once."""
+    # BASENAME may itself contain a directory, so list each path's own
+    # directory rather than assuming output_dir
+    listings = {}
+    existing = []
+    for p in paths:
+        directory = os.path.dirname(p) or '.'
+        if directory not in listings:
+            try:
+                with os.scandir(directory) as it:
+                    listings[directory] = {entry.name for entry in it}
+            except OSError:
+                listings[directory] = set()
+        if os.path.basename(p) in listings[directory]:
+            existing.append(p)
+    return existing
+
+
+def run_combine(output_dir, basename, input_suffixes, output_suffix):
+    """Run pcb2gcode-combine on multiple fixed-up files."""
+    input_files = [output_path(output_dir, basename, s, EXT_FIXUP) for s in input_suffixes]
+    existing_files = existing_outputs(input_files)
 
     if len(existing_files) < 2:
         print(f"Warning: Need at least 2 files to combine, found {len(existing_files)}")
@@ -200,11 +299,7 @@ def run_combine(output_dir, basename, input_suffixes, output_suffix, fixup_avail
 
     combined_file = output_path(output_dir, basename, output_suffix)
     print("\nCombining drill operations...")
-    cmd = f"{COMBINE_CMD} {' '.join(existing_files)} -o {combined_file}"
-    print(f"Running: {cmd}")
-    result = subprocess.run(cmd, shell=True)
-
-    if result.returncode == 0:
+    if run_tool(combine.main, [COMBINE_CMD, *existing_files, '-o', combined_file]) == 0:
         print(f"Created combined file: {combined_file}")
         return True
     else:
@@ -215,7 +310,7 @@ def run_combine(output_dir, basename, input_suffixes, output_suffix, fixup_avail
 def run_multitool(output_dir, basename, input_suffixes, output_suffix):
     """Run pcb2gcode-combine --multi on multiple files."""
     input_files = [output_path(output_dir, basename, s) for s in input_suffixes]
-    existing_files = [f for f in input_files if os.path.exists(f)]
+    existing_files = existing_outputs(input_files)
 
     if len(existing_files) < 2:
         print(f"Warning: Need at least 2 files for --multi, found {len(existing_files)}")
@@ -223,11 +318,7 @@ def run_multitool(output_dir, basename, input_suffixes, output_suffix):
 
     all_file = output_path(output_dir, basename, output_suffix)
     print("\nCreating multi-tool combined file...")
-    cmd = f"{COMBINE_CMD} --multi {' '.join(existing_files)} -o {all_file}"
-    print(f"Running: {cmd}")
-    result = subprocess.run(cmd, shell=True)
-
-    if result.returncode == 0:
+    if run_tool(combine.main, [COMBINE_CMD, '--multi', *existing_files, '-o', all_file]) == 0:
         print(f"Created multi-tool file: {all_file}")
         return True
     else:
@@ -235,14 +326,13 @@ def run_multitool(output_dir, basename, input_suffixes, output_suffix):
         return False
 
 
-def rename_back_file(output_dir, basename, fixup_available):
-    """Rename back file to _00_back for sorting."""
-    ext = EXT_FIXUP if fixup_available else EXT_NGC
-    back_file = output_path(output_dir, basename, OUTPUT_BACK, ext)
+def rename_back_file(output_dir, basename):
+    """Rename the fixed-up back file to _00_back for sorting."""
+    back_file = output_path(output_dir, basename, OUTPUT_BACK, EXT_FIXUP)
     back_file_renamed = output_path(output_dir, basename, OUTPUT_00_BACK)
 
     if os.path.exists(back_file):
-        os.rename(back_file, back_file_renamed)
+        os.replace(back_file, back_file_renamed)
         print(f"Renamed: {back_file} -> {back_file_renamed}")
 
 
@@ -274,11 +364,13 @@ The --x-offset parameter is automatically calculated from edge cuts if present.
                         help='Override automatic x-offset calculation')
     parser.add_argument('--y-offset', type=float, metavar='MM',
                         help='Override automatic y-offset calculation')
+    parser.add_argument('--jobs', type=int, metavar='N', default=min(3, os.cpu_count() or 1),
+                        help='Run up to N pcb2gcode processes in parallel (default: min(3, CPU count))')
     # Parse known args, pass the rest to pcb2gcode
     args, extra_args = parser.parse_known_args()
 
     basename = args.basename
-    other_args = ' '.join(extra_args)
+    other_args = list(extra_args)
 
     # Handle output directory
     output_dir = ''
@@ -288,7 +380,7 @@ The --x-offset parameter is automatically calculated from edge cuts if present.
         if not os.path.isdir(output_dir):
             print(f"Error: Output directory '{output_dir}' does not exist.", file=sys.stderr)
             sys.exit(1)
-        other_args += f" --output-dir={output_dir}"
+        other_args.append(f"--output-dir={output_dir}")
 
     # Calculate x-offset from edge cuts file
     edge_cuts_file = f"{basename}{INPUT_EDGE_CUTS}"
@@ -302,57 +394,36 @@ The --x-offset parameter is automatically calculated from edge cuts if present.
 
     # Add x-offset to args
     if x_offset is not None:
-        other_args += f" --x-offset={x_offset}"
+        other_args.append(f"--x-offset={x_offset}")
         print(f"Automatically added --x-offset={x_offset} to commands")
 
     # Add y-offset to args
     y_offset = args.y_offset if args.y_offset is not None else args.y_margin
-    other_args += f" --y-offset={y_offset}"
-
-    # Check for helper tools
-    fixup_available = command_available(FIXUP_CMD)
-    print(f"{FIXUP_CMD} {'found' if fixup_available else 'not found'} in PATH")
-
-    combine_available = command_available(COMBINE_CMD)
-    print(f"{COMBINE_CMD} {'found' if combine_available else 'not found'} in PATH")
+    other_args.append(f"--y-offset={y_offset}")
 
-    # Run back copper
-    back_cmd = f"pcb2gcode --back {basename}{INPUT_BACK_COPPER} --basename {basename} {other_args}"
-    run_command(back_cmd, "Processing back copper")
-    run_fixup(output_dir, basename, OUTPUT_BACK, fixup_available)
-
-    # Run drill
-    drill_cmd = f"pcb2gcode --drill {basename}{INPUT_DRILL} --drill-side back --basename {basename} {other_args}"
-    run_command(drill_cmd, "Processing drill holes")
-    run_fixup(output_dir, basename, OUTPUT_DRILL, fixup_available)
-    run_fixup(output_dir, basename, OUTPUT_MILLDRILL, fixup_available)
-
-    # Run outline
-    outline_cmd = f"pcb2gcode --outline {basename}{INPUT_EDGE_CUTS} --cut-side back --basename {basename} {other_args}"
-    run_command(outline_cmd, "Processing board outline")
-    run_fixup(output_dir, basename, OUTPUT_OUTLINE, fixup_available)
+    # Back copper, drill and outline, each followed by fixup of its outputs
+    runs = [(description,
+             ['pcb2gcode', flag, f"{basename}{input_suffix}", *extra_flags, '--basename', basename, *other_args],
+             suffixes)
+            for description, flag, input_suffix, extra_flags, suffixes in PIPELINE]
+    run_pcb2gcode_all(runs, args.jobs, output_dir, basename)
 
     # Track whether any optional steps failed
     had_failures = False
 
     # Combine drill, milldrill, and outline into a single file
-    if not args.no_combine and combine_available:
+    if not args.no_combine:
         combine_inputs = [OUTPUT_DRILL, OUTPUT_MILLDRILL, OUTPUT_OUTLINE]
-        if run_combine(output_dir, basename, combine_inputs, OUTPUT_01_DRILL, fixup_available):
-            rename_back_file(output_dir, basename, fixup_available)
+        if run_combine(output_dir, basename, combine_inputs, OUTPUT_01_DRILL):
+            rename_back_file(output_dir, basename)
         else:
             had_failures = True
-    elif not args.no_combine:
-        print(f"\nSkipping combine: {COMBINE_CMD} not found in PATH")
 
     # Create multi-tool combined file if requested
     if args.multi:
-        if combine_available:
-            multi_inputs = [OUTPUT_00_BACK, OUTPUT_01_DRILL]
-            if not run_multitool(output_dir, basename, multi_inputs, OUTPUT_000_ALL):
-                had_failures = True
-        else:
-            print(f"\nSkipping --multi: {COMBINE_CMD} not found in PATH")
+        multi_inputs = [OUTPUT_00_BACK, OUTPUT_01_DRILL]
+        if not run_multitool(output_dir, basename, multi_inputs, OUTPUT_000_ALL):
+            had_failures = True
 
     if had_failures:
         print("\nCompleted with warnings - some operations failed (see above).")